@@ -4,11 +4,41 @@ nekkoOS FAT12 Disk Image Creator
 Creates a proper FAT12 filesystem with bootloader and files
 """
 
+import mmap
 import os
 import struct
 import sys
+from array import array
 from datetime import datetime
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # NumPy is optional; pure-Python fallbacks are used without it
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None  # Numba is optional; NumPy/pure-Python paths are used without it
+
+if np is not None and njit is not None:
+    @njit(cache=True)
+    def _pack_fat12(fat, out):
+        """JIT-compiled 12-bit FAT packing: two entries into three bytes"""
+        for i in range(0, fat.shape[0], 2):
+            # Pack the pair into one 24-bit word, then three plain byte stores
+            packed = (fat[i] & 0xFFF) | ((fat[i + 1] & 0xFFF) << 12)
+            j = (i * 3) // 2
+            out[j] = packed & 0xFF
+            out[j + 1] = (packed >> 8) & 0xFF
+            out[j + 2] = (packed >> 16) & 0xFF
+else:
+    _pack_fat12 = None
+
+# Prebuilt packers so the format strings are parsed once, not per call
+_BPB = struct.Struct('<8sHBHBHHBHHHLLBBBL11s8s')
+_DIR_ENTRY = struct.Struct('<11sBBBHHHHHHHL')
+
 class FAT12Builder:
     def __init__(self, image_size=1474560):  # 1.44MB floppy size
         self.image_size = image_size
@@ -29,19 +59,31 @@ class FAT12Builder:
         self.root_sectors = (self.root_entries * 32 + self.bytes_per_sector - 1) // self.bytes_per_sector
         self.data_start = self.root_start + self.root_sectors
         
-        # Initialize disk image
-        self.image = bytearray(image_size)
-        
         # FAT table (12-bit entries)
-        self.fat = [0] * ((self.sectors_per_fat * self.bytes_per_sector * 2) // 3)
+        fat_entries = (self.sectors_per_fat * self.bytes_per_sector * 2) // 3
+        if np is not None:
+            self.fat = np.zeros(fat_entries, dtype=np.uint16)
+        else:
+            self.fat = array('H', bytes(2 * fat_entries))
         self.fat[0] = 0xFF0  # Media descriptor in FAT
         self.fat[1] = 0xFFF  # End of chain marker
         
-        # Root directory entries
-        self.root_entries_data = []
-        
+        # Root directory, written in place as entries are added
+        self.root_data = bytearray(self.root_sectors * self.bytes_per_sector)
+        self.root_offset = 0
+
+        # File payloads waiting to be streamed out (first_cluster, data)
+        self.file_payloads = []
+
         # Next available cluster
         self.next_cluster = 2
+
+        # All files share the build timestamp; encode it once
+        now = datetime.now()
+        # Date format: bits 15-9 = year-1980, bits 8-5 = month, bits 4-0 = day
+        self._fat_date = ((now.year - 1980) << 9) | (now.month << 5) | now.day
+        # Time format: bits 15-11 = hours, bits 10-5 = minutes, bits 4-0 = seconds/2
+        self._fat_time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
         
     def create_boot_sector(self, boot_code):
         """Create FAT12 boot sector with bootloader code"""
@@ -51,10 +93,10 @@ class FAT12Builder:
         # Ensure boot sector is exactly 512 bytes
         if len(boot_sector) > 512:
             raise ValueError("Boot code too large for boot sector")
-        boot_sector.extend([0] * (512 - len(boot_sector)))
+        boot_sector += b'\x00' * (512 - len(boot_sector))
         
         # Write FAT12 BPB (BIOS Parameter Block) starting at offset 3
-        bpb = struct.pack('<8sHBHBHHBHHHLLBBBL11s8s',
+        bpb = _BPB.pack(
             b'NEKKOOS ',              # OEM identifier (8 bytes)
             self.bytes_per_sector,     # Bytes per sector
             self.sectors_per_cluster,  # Sectors per cluster
@@ -86,81 +128,71 @@ class FAT12Builder:
     
     def add_file(self, filename, data):
         """Add a file to the FAT12 filesystem"""
+        # Accept any buffer (bytes, bytearray, mmap, ...) without copying
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
+
         # Convert filename to 8.3 format
         name_83 = self.convert_to_83(filename)
         
         # Calculate number of clusters needed
-        clusters_needed = (len(data) + (self.sectors_per_cluster * self.bytes_per_sector) - 1) // (self.sectors_per_cluster * self.bytes_per_sector)
+        cluster_bytes = self.sectors_per_cluster * self.bytes_per_sector
+        clusters_needed = (len(data) + cluster_bytes - 1) // cluster_bytes
         
         if clusters_needed == 0:
             clusters_needed = 1
             
-        # Allocate clusters
+        # Allocate clusters: each entry points to the next, last marks end of chain
         first_cluster = self.next_cluster
-        current_cluster = first_cluster
-        
-        for i in range(clusters_needed):
-            if i == clusters_needed - 1:
-                # Last cluster
-                self.fat[current_cluster] = 0xFFF  # End of chain
-            else:
-                # Point to next cluster
-                self.fat[current_cluster] = current_cluster + 1
-                current_cluster += 1
-        
+        last_cluster = first_cluster + clusters_needed - 1
+
+        if np is not None:
+            self.fat[first_cluster:last_cluster] = np.arange(
+                first_cluster + 1, last_cluster + 1, dtype=np.uint16)
+        else:
+            self.fat[first_cluster:last_cluster] = array(
+                'H', range(first_cluster + 1, last_cluster + 1))
+        self.fat[last_cluster] = 0xFFF  # End of chain
+
         self.next_cluster += clusters_needed
         
-        # Create directory entry
+        # Create directory entry and drop it straight into the root buffer
         entry = self.create_dir_entry(name_83, len(data), first_cluster)
-        self.root_entries_data.append(entry)
-        
-        # Write file data to clusters
-        offset = 0
-        current_cluster = first_cluster
-        
-        while offset < len(data):
-            # Calculate sector for this cluster
-            sector = self.data_start + (current_cluster - 2) * self.sectors_per_cluster
-            sector_offset = sector * self.bytes_per_sector
-            
-            # Write data to this cluster
-            chunk_size = min(self.sectors_per_cluster * self.bytes_per_sector, len(data) - offset)
-            self.image[sector_offset:sector_offset + chunk_size] = data[offset:offset + chunk_size]
-            
-            offset += chunk_size
-            
-            # Get next cluster
-            if self.fat[current_cluster] == 0xFFF:
-                break
-            current_cluster = self.fat[current_cluster]
+        if self.root_offset + 32 > len(self.root_data):
+            raise ValueError("Root directory full")
+        self.root_data[self.root_offset:self.root_offset + 32] = entry
+        self.root_offset += 32
+
+        # Keep the payload; it is streamed to the output file in build()
+        self.file_payloads.append((first_cluster, data))
     
     def convert_to_83(self, filename):
-        """Convert filename to 8.3 format"""
-        if '.' in filename:
-            name, ext = filename.upper().split('.', 1)
+        """Convert filename to 8.3 format (11 space-padded ASCII bytes)"""
+        out = bytearray(b' ' * 11)
+
+        dot = filename.rfind('.')
+        if dot >= 0:
+            name = filename[:dot].encode('ascii')
+            ext = filename[dot + 1:].encode('ascii')
         else:
-            name = filename.upper()
-            ext = ''
-        
-        # Pad or truncate name to 8 characters
-        name = name[:8].ljust(8)
-        # Pad or truncate extension to 3 characters
-        ext = ext[:3].ljust(3)
-        
-        return name + ext
+            name = filename.encode('ascii')
+            ext = b''
+
+        # Copy name and extension, uppercasing a-z byte-wise
+        for i, c in enumerate(name[:8]):
+            out[i] = c - 0x20 if 0x61 <= c <= 0x7A else c
+        for i, c in enumerate(ext[:3]):
+            out[8 + i] = c - 0x20 if 0x61 <= c <= 0x7A else c
+
+        return bytes(out)
     
     def create_dir_entry(self, name_83, file_size, first_cluster):
         """Create a directory entry"""
-        now = datetime.now()
-        
-        # Date format: bits 15-9 = year-1980, bits 8-5 = month, bits 4-0 = day
-        date = ((now.year - 1980) << 9) | (now.month << 5) | now.day
-        
-        # Time format: bits 15-11 = hours, bits 10-5 = minutes, bits 4-0 = seconds/2
-        time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
-        
-        return struct.pack('<11sBBBHHHHHHHL',
-            name_83.encode('ascii'),   # Filename (11 bytes)
+        date = self._fat_date
+        time = self._fat_time
+
+        return _DIR_ENTRY.pack(
+            name_83,                   # Filename (11 bytes)
             0x20,                      # Attributes (archive)
             0,                         # Reserved
             0,                         # Creation time fine resolution
@@ -174,45 +206,60 @@ class FAT12Builder:
             file_size                  # File size
         )
     
-    def write_fat(self):
-        """Write FAT tables to disk image"""
+    def write_fat(self, f):
+        """Write FAT tables to the output file"""
         # Convert 12-bit FAT entries to byte array
-        fat_bytes = bytearray(self.sectors_per_fat * self.bytes_per_sector)
-        
-        for i in range(0, len(self.fat), 2):
-            if i + 1 < len(self.fat):
-                # Pack two 12-bit values into 3 bytes
-                val1 = self.fat[i] & 0xFFF
-                val2 = self.fat[i + 1] & 0xFFF
-                
-                # Convert to 3 bytes
-                byte_offset = (i * 3) // 2
-                if byte_offset + 2 < len(fat_bytes):
-                    fat_bytes[byte_offset] = val1 & 0xFF
-                    fat_bytes[byte_offset + 1] = ((val1 >> 8) & 0x0F) | ((val2 & 0x0F) << 4)
-                    fat_bytes[byte_offset + 2] = (val2 >> 4) & 0xFF
-        
-        # Write both FAT copies
+        fat_size = self.sectors_per_fat * self.bytes_per_sector
+
+        if np is not None:
+            fat_bytes = np.zeros(fat_size, dtype=np.uint8)
+            if _pack_fat12 is not None:
+                # Numba-compiled scalar loop
+                _pack_fat12(self.fat, fat_bytes)
+            else:
+                # Pack every pair of 12-bit entries into 3 bytes with strided
+                # vector stores instead of a per-pair Python loop
+                pairs = self.fat.reshape(-1, 2)
+                lo = pairs[:, 0]
+                hi = pairs[:, 1]
+                fat_bytes[0::3] = (lo & 0xFF).astype(np.uint8)
+                fat_bytes[1::3] = (((lo >> 8) & 0x0F) | ((hi & 0x0F) << 4)).astype(np.uint8)
+                fat_bytes[2::3] = ((hi >> 4) & 0xFF).astype(np.uint8)
+            fat_bytes = memoryview(fat_bytes)
+        else:
+            fat_bytes = bytearray(fat_size)
+
+            for i in range(0, len(self.fat), 2):
+                if i + 1 < len(self.fat):
+                    # Pack the two 12-bit values into one 24-bit word
+                    packed = (self.fat[i] & 0xFFF) | ((self.fat[i + 1] & 0xFFF) << 12)
+
+                    # Convert to 3 bytes
+                    byte_offset = (i * 3) // 2
+                    if byte_offset + 2 < len(fat_bytes):
+                        fat_bytes[byte_offset] = packed & 0xFF
+                        fat_bytes[byte_offset + 1] = (packed >> 8) & 0xFF
+                        fat_bytes[byte_offset + 2] = (packed >> 16) & 0xFF
+        
+        # FAT copies are sector-adjacent: seek once, then write each in turn
+        f.seek(self.fat_start * self.bytes_per_sector)
         for fat_copy in range(self.fat_copies):
-            start_sector = self.fat_start + (fat_copy * self.sectors_per_fat)
-            start_offset = start_sector * self.bytes_per_sector
-            self.image[start_offset:start_offset + len(fat_bytes)] = fat_bytes
-    
-    def write_root_directory(self):
-        """Write root directory to disk image"""
-        root_data = bytearray(self.root_sectors * self.bytes_per_sector)
-        
-        # Write directory entries
-        offset = 0
-        for entry in self.root_entries_data:
-            if offset + len(entry) <= len(root_data):
-                root_data[offset:offset + len(entry)] = entry
-                offset += len(entry)
-        
-        # Write to disk image
-        start_offset = self.root_start * self.bytes_per_sector
-        self.image[start_offset:start_offset + len(root_data)] = root_data
-    
+            f.write(fat_bytes)
+
+    def write_root_directory(self, f):
+        """Write root directory to the output file"""
+        f.seek(self.root_start * self.bytes_per_sector)
+        f.write(self.root_data)
+
+    def write_file_data(self, f):
+        """Stream file payloads to their clusters in the output file"""
+        # add_file allocates clusters contiguously, so each payload is one
+        # contiguous run of sectors and a single write
+        for first_cluster, data in self.file_payloads:
+            sector = self.data_start + (first_cluster - 2) * self.sectors_per_cluster
+            f.seek(sector * self.bytes_per_sector)
+            f.write(data)
+
     def build(self, boot_sector_file, files, output_file):
         """Build the complete FAT12 disk image"""
         print(f"Building FAT12 disk image: {output_file}")
@@ -227,30 +274,39 @@ class FAT12Builder:
         
         # Create boot sector with FAT12 BPB
         boot_sector = self.create_boot_sector(boot_code)
-        self.image[0:512] = boot_sector
-        
+
         print(f"Boot sector: {boot_sector_file} ({len(boot_code)} bytes)")
-        
-        # Add files
-        for filename, filepath in files.items():
-            try:
-                with open(filepath, 'rb') as f:
-                    file_data = f.read()
-                self.add_file(filename, file_data)
-                print(f"Added file: {filename} -> {filepath} ({len(file_data)} bytes)")
-            except FileNotFoundError:
-                print(f"Warning: File '{filepath}' not found, skipping")
-        
-        # Write FAT tables
-        self.write_fat()
-        
-        # Write root directory
-        self.write_root_directory()
-        
-        # Write disk image
+
+        # Map each payload read-only; pages go straight from the page cache
+        # to the output file with no intermediate read buffer. The maps must
+        # stay alive until write_file_data has streamed them out.
+        mapped = []
         try:
-            with open(output_file, 'wb') as f:
-                f.write(self.image)
+            for filename, filepath in files:
+                try:
+                    with open(filepath, 'rb') as f:
+                        if os.fstat(f.fileno()).st_size == 0:
+                            data = b''  # empty files cannot be mapped
+                        else:
+                            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                            mapped.append(data)
+                except FileNotFoundError:
+                    print(f"Warning: File '{filepath}' not found, skipping")
+                    continue
+                self.add_file(filename, data)
+                print(f"Added file: {filename} -> {filepath} ({len(data)} bytes)")
+
+            # Stream only the populated regions; truncate pads the rest with zeros
+            try:
+                with open(output_file, 'wb') as f:
+                    f.truncate(self.image_size)
+                    f.write(boot_sector)
+                    self.write_fat(f)
+                    self.write_root_directory(f)
+                    self.write_file_data(f)
+            except Exception as e:
+                print(f"Error writing disk image: {e}")
+                return False
             print(f"FAT12 disk image created: {output_file}")
             
             # Print filesystem info
@@ -266,10 +322,12 @@ class FAT12Builder:
             print(f"  Data start sector: {self.data_start}")
             
             return True
-            
-        except Exception as e:
-            print(f"Error writing disk image: {e}")
-            return False
+
+        finally:
+            # Drop the stored memoryviews before closing the maps they cover
+            self.file_payloads.clear()
+            for mm in mapped:
+                mm.close()
 
 def main():
     if len(sys.argv) < 2:
@@ -279,11 +337,11 @@ def main():
     
     build_dir = sys.argv[1]
     
-    # File mappings: FAT12_name -> local_path
-    files = {
-        'STAGE2.BIN': os.path.join(build_dir, 'stage2.bin'),
-        'KERNEL.BIN': os.path.join(build_dir, 'kernel.bin'),
-    }
+    # File mappings: (FAT12_name, local_path), in image order
+    files = [
+        ('STAGE2.BIN', os.path.join(build_dir, 'stage2.bin')),
+        ('KERNEL.BIN', os.path.join(build_dir, 'kernel.bin')),
+    ]
     
     # Build FAT12 image
     builder = FAT12Builder()